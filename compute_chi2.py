@@ -1,13 +1,317 @@
+import os
+import tempfile
+import warnings
+import zipfile
+import multiprocessing as mp
+from functools import partial
+
 import numpy as np
 import pandas as pd
+import astropy.units as u
+import astropy.constants as consts
 
-from orbitize.kepler import calc_orbit
-from orbitize.radvel_utils.compute_sep import compute_sep
+from orbitize.kepler import _calc_ecc_anom
 from astroquery.vizier import Vizier
 from astropy.time import Time
 from astropy.coordinates import get_body_barycentric_posvel
 
-import matplotlib.pyplot as plt
+try:
+    import numba
+    from numba import njit, prange
+    numba_installed = True
+except ImportError:
+    numba_installed = False
+
+    # no-op stand-ins so the kernels below remain importable (and callable, slowly)
+    prange = range
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+try:
+    import numexpr as ne
+    numexpr_installed = True
+except ImportError:
+    numexpr_installed = False
+
+
+# fastmath flags for `_chi2_kernel`. Excludes 'reassoc', which would let the 
+# compiler optimize away the Kahan compensation term.
+_CHI2_FASTMATH = {'nnan', 'ninf', 'nsz', 'arcp', 'contract', 'afn'}
+
+
+@njit(cache=True)
+def _parallactic_offsets(plx, pm_ra, pm_dec, A, B, dt):
+    """
+    Parallactic ellipse + proper motion offsets of the star from its 1991.25 
+    position (Nielsen+ 2020 Eqs 1-2). Arguments may be scalars or mutually 
+    broadcastable arrays, e.g. catalog scalars against per-epoch vectors, or
+    (1 x n_samples) parameters against (n_epochs x 1) epoch vectors. Compiled 
+    with numba so that `_chi2_kernel` can call it per (sample, epoch) with 
+    scalars; only the numexpr path of `HipparcosLogProb.compute_lnprob` inlines
+    the same expressions.
+
+    Args:
+        plx (float or np.array): parallax [mas]
+        pm_ra, pm_dec (float or np.array): RA/Dec proper motions [mas/yr]
+        A, B (float or np.array): RA/Dec parallax factors [au] (see 
+            `HipparcosLogProb._precompute_geometry`)
+        dt (float or np.array): time since 1991.25 [yr]
+
+    Returns:
+        2-tuple of float or np.array: RA and Dec offsets [mas]
+    """
+    d_alpha = plx * A + dt * pm_ra
+    d_delta = plx * B + dt * pm_dec
+
+    return d_alpha, d_delta
+
+
+@njit(parallel=True, fastmath=_CHI2_FASTMATH, cache=True)
+def _chi2_kernel(
+    pm_ra, pm_dec, alpha_H0, delta_H0, plx, raoff, decoff, A, B, dt, 
+    alpha_abs_st, delta_abs, cos_phi, sin_phi, inv_eps2
+):
+    """
+    Fused model + residual + chi2 computation (Nielsen+ 2020 Eqs 6-8). Streams 
+    over epochs for each sample, so no (n_epochs x n_samples) temporaries are 
+    allocated apart from the orbit offsets themselves.
+    All inputs except `inv_eps2` may be float32; chi2 is accumulated in float64
+    with compensated (Kahan) summation.
+
+    Args:
+        pm_ra, pm_dec, alpha_H0, delta_H0, plx (np.array of float): length 
+            n_samples astrometric parameters (see `HipparcosLogProb.compute_lnprob`)
+        raoff, decoff (np.array of float): (n_epochs x n_samples) RA/Dec offsets 
+            of the star relative to the barycenter [mas]. Pass empty (0 x 0) 
+            arrays for a parallax-only model.
+        A, B (np.array of float): length n_epochs RA/Dec parallax factors [au]
+        dt (np.array of float): length n_epochs time since 1991.25 [yr]
+        alpha_abs_st, delta_abs (np.array of float): length n_epochs abscissa 
+            points (Nielsen+ 2020 Eq 3) [mas]
+        cos_phi, sin_phi (np.array of float): length n_epochs scan direction
+        inv_eps2 (np.array of float): length n_epochs inverse abscissa 
+            variances [mas^-2]
+
+    Returns:
+        np.array of length n_samples: chi2 of each sample
+    """
+    n_samples = len(pm_ra)
+    n_epochs = len(dt)
+    include_orbit = raoff.shape[0] > 0
+
+    chi2 = np.empty(n_samples)
+    for s in prange(n_samples):
+        chi2_s = 0.0
+        comp = 0.0 # running Kahan compensation
+        for i in range(n_epochs):
+            d_alpha, d_delta = _parallactic_offsets(
+                plx[s], pm_ra[s], pm_dec[s], A[i], B[i], dt[i]
+            )
+            a = alpha_H0[s] + d_alpha
+            d = delta_H0[s] + d_delta
+            if include_orbit:
+                a += raoff[i, s]
+                d += decoff[i, s]
+            r = (alpha_abs_st[i] - a) * cos_phi[i] + (delta_abs[i] - d) * sin_phi[i]
+            term = np.float64(r) * np.float64(r) * inv_eps2[i] - comp
+            total = chi2_s + term
+            comp = (total - chi2_s) - term
+            chi2_s = total
+        chi2[s] = chi2_s
+
+    return chi2
+
+
+# orbital period [day] of a 1 au orbit around 1 M_sun; scales as sqrt(sma^3 / mtot)
+_PERIOD_UNIT = (2 * np.pi * np.sqrt(u.au**3 / (consts.G * u.Msun))).to(u.day).value
+
+# Tabulate the eccentric anomaly E(M, e) once with orbitize's Kepler solver, so
+# that orbit models only need a bilinear lookup (see `_interp_sincosE`). E varies
+# too sharply near periastron at high e for the lookup to stay accurate, so more
+# eccentric orbits are solved directly instead (see `_calc_orbit_radec`). The 
+# lookup is only worthwhile compiled, so without numba every orbit is solved 
+# directly and the table is not built.
+_ECC_GRID_MAX = 0.9
+if numba_installed:
+    _manom_grid, _ecc_grid = np.meshgrid(
+        np.linspace(0, 2 * np.pi, 4096), np.linspace(0, _ECC_GRID_MAX, 256), 
+        indexing='ij'
+    )
+    _eanom_grid = _calc_ecc_anom(_manom_grid.ravel(), _ecc_grid.ravel()).reshape(
+        _manom_grid.shape
+    )
+    _sinE_tab = np.sin(_eanom_grid)
+    _cosE_tab = np.cos(_eanom_grid)
+    del _manom_grid, _ecc_grid, _eanom_grid
+
+
+@njit(parallel=True, cache=True)
+def _interp_sincosE(M, ecc, sinE_tab, cosE_tab):
+    """
+    Bilinearly interpolates sin(E) and cos(E) from tables computed on a regular
+    (M, e) grid spanning [0, 2pi] x [0, _ECC_GRID_MAX]. Points outside the grid
+    (including NaNs) are returned as NaN rather than extrapolated. Loops over
+    elements, so nothing beyond the two outputs is allocated.
+
+    Args:
+        M (np.array of float): (n_epochs x n_samples) mean anomalies in 
+            [0, 2pi) [rad]
+        ecc (np.array of float): length n_samples eccentricities
+        sinE_tab, cosE_tab (np.array of float): (n_M x n_e) tabulated sin(E) 
+            and cos(E)
+
+    Returns:
+        2-tuple of (n_epochs x n_samples) np.array: sin(E) and cos(E)
+    """
+    n_epochs, n_samples = M.shape
+    n_M, n_e = sinE_tab.shape
+    x_scale = (n_M - 1) / (2 * np.pi)
+    y_scale = (n_e - 1) / _ECC_GRID_MAX
+
+    sinE = np.empty((n_epochs, n_samples))
+    cosE = np.empty((n_epochs, n_samples))
+    for i in prange(n_epochs):
+        for s in range(n_samples):
+            m = M[i, s]
+            e = ecc[s]
+            if not (m >= 0 and m <= 2 * np.pi and e >= 0 and e <= _ECC_GRID_MAX):
+                sinE[i, s] = np.nan
+                cosE[i, s] = np.nan
+                continue
+
+            # lower-left grid cell corner & bilinear weights
+            x = m * x_scale
+            y = e * y_scale
+            k = min(int(x), n_M - 2)
+            j = min(int(y), n_e - 2)
+            wx = x - k
+            wy = y - j
+            w00 = (1 - wx) * (1 - wy)
+            w01 = (1 - wx) * wy
+            w10 = wx * (1 - wy)
+            w11 = wx * wy
+
+            sinE[i, s] = (
+                w00 * sinE_tab[k, j] + w01 * sinE_tab[k, j + 1] + 
+                w10 * sinE_tab[k + 1, j] + w11 * sinE_tab[k + 1, j + 1]
+            )
+            cosE[i, s] = (
+                w00 * cosE_tab[k, j] + w01 * cosE_tab[k, j + 1] + 
+                w10 * cosE_tab[k + 1, j] + w11 * cosE_tab[k + 1, j + 1]
+            )
+
+    return sinE, cosE
+
+
+def _calc_orbit_radec(epochs, sma, ecc, inc, aop, pan, tau, plx, mtot, tau_ref_epoch=58849):
+    """
+    Minimal version of `orbitize.kepler.calc_orbit` that only returns the RA/Dec
+    offsets, using the tabulated eccentric anomalies and the Thiele-Innes 
+    constants rather than an iterative Kepler solve. Orbits with eccentricities
+    beyond the table (_ECC_GRID_MAX < e < 1), or all orbits if numba is not 
+    installed, fall back to orbitize's solver. Unphysical orbits (e.g. e < 0, 
+    e >= 1, sma < 0) give NaN offsets. Follows orbitize conventions for all 
+    parameters.
+
+    Args:
+        epochs (np.array of float): MJD times of length n_epochs
+        sma, ecc, inc, aop, pan, tau, plx, mtot (np.array of float): orbital
+            parameters of length n_samples (see `HipparcosLogProb.compute_lnprob`)
+        tau_ref_epoch (float, optional): reference MJD that tau is defined 
+            with respect to. Default: 58849.
+
+    Returns:
+        2-tuple of (n_epochs x n_samples) np.array: RA and Dec offsets of the 
+            secondary relative to the primary [mas]
+    """
+    period = _PERIOD_UNIT * np.sqrt(sma**3 / mtot) # [day]
+
+    # mean anomaly (size: n_epochs x n_samples), computed in place
+    manom = (epochs[:, None] - tau_ref_epoch) / period
+    manom %= 1
+    manom -= tau
+    manom *= 2 * np.pi
+    manom %= 2 * np.pi
+
+    if numba_installed:
+        sinE, cosE = _interp_sincosE(manom, ecc, _sinE_tab, _cosE_tab)
+        direct = (ecc > _ECC_GRID_MAX) & (ecc < 1)
+    else:
+        sinE = np.empty_like(manom)
+        cosE = np.empty_like(manom)
+        direct = (ecc >= 0) & (ecc < 1)
+        sinE[:, ~direct] = np.nan
+        cosE[:, ~direct] = np.nan
+
+    # solve Kepler's equation directly where the table isn't used
+    if direct.any():
+        eanom = _calc_ecc_anom(
+            manom[:, direct], np.tile(ecc[direct], (manom.shape[0], 1))
+        )
+        sinE[:, direct] = np.sin(eanom)
+        cosE[:, direct] = np.cos(eanom)
+    del manom
+
+    # elliptical rectangular coordinates in the orbital plane (in place)
+    x_orb = cosE
+    x_orb -= ecc
+    y_orb = sinE
+    y_orb *= np.sqrt(1 - ecc**2)
+
+    # Thiele-Innes constants [mas]
+    ci = np.cos(inc)
+    so, co = np.sin(aop), np.cos(aop)
+    sO, cO = np.sin(pan), np.cos(pan)
+    a_mas = sma * plx
+    A = a_mas * (co * cO - so * sO * ci)
+    B = a_mas * (co * sO + so * cO * ci)
+    F = a_mas * (-so * cO - co * sO * ci)
+    G = a_mas * (-so * sO + co * cO * ci)
+
+    raoff = B * x_orb
+    raoff += G * y_orb
+    decoff = x_orb
+    decoff *= A
+    decoff += F * y_orb
+
+    return raoff, decoff
+
+
+def _read_iad(file_name):
+    """
+    Parses a Hipparcos IAD file (same rows as `np.loadtxt(file_name, skiprows=1)`:
+    the first line and '#' comment lines are skipped), using pandas' faster 
+    ASCII reader.
+
+    Args:
+        file_name (str): path to the `HIP*.d` IAD file
+
+    Returns:
+        np.array of float: (n_columns x n_epochs) array, with one contiguous row 
+            per IAD column
+    """
+    iad = pd.read_csv(
+        file_name, sep=r'\s+', skiprows=1, header=None, comment='#'
+    ).to_numpy(dtype=np.float64)
+
+    # transpose to one contiguous row per IAD column (a bare transpose is an F-order view)
+    return np.ascontiguousarray(iad.T)
+
+
+# attributes of `HipparcosLogProb` that are saved to/loaded from the on-disk cache
+_CACHED_ATTRS = [
+    'plx0', 'pm_ra0', 'pm_dec0', 'alpha0', 'delta0', 'plx0_err', 'pm_ra0_err', 
+    'pm_dec0_err', 'alpha0_err', 'delta0_err', 'epochs', 'epochs_mjd', 'cos_phi', 
+    'sin_phi', 'R', 'eps', 'X', 'Y', 'Z'
+]
+
+# object & samples shared with forked `compute_lnprob_batched` workers
+_pool_logprob = None
+_pool_samples = None
+
 
 class HipparcosLogProb(object):
     """
@@ -19,6 +323,19 @@ class HipparcosLogProb(object):
 
     Args:
         hip_num (str): the Hipparcos number of your target. Accessible on Simbad.
+        use_numba (bool, optional): if True (and numba is installed), compute 
+            chi2 with a compiled, multithreaded kernel. Otherwise use numexpr 
+            (if installed) or NumPy broadcasting. Default: True.
+        dtype (np.dtype, optional): floating point type of the per-epoch and 
+            per-sample arrays entering the chi2 sweep; chi2 is always 
+            accumulated in float64. np.float32 reduces memory traffic but 
+            perturbs lnprob at the ~1e-5 relative level, which is too coarse 
+            for finite-difference gradients (e.g. scipy.optimize). 
+            Default: np.float64.
+        cache_dir (str, optional): directory in which the catalog solution, IAD,
+            and Earth ephemeris are cached as `<hip_num>.npz`, skipping the 
+            Vizier query and IAD parse on subsequent instantiations. None 
+            disables caching. Default: '~/.cache/hipiad'.
 
     Caveats:
         Currently only treats 2-body systems. i.e. I haven't worked through the
@@ -27,11 +344,148 @@ class HipparcosLogProb(object):
         Must be run on cadence so data are available. 
     """
 
-    def __init__(self, hip_num='027321'):
+    def __init__(
+        self, hip_num='027321', use_numba=True, dtype=np.float64, 
+        cache_dir='~/.cache/hipiad'
+    ):
 
         self.hip_num = hip_num
+        self.use_numba = use_numba and numba_installed
+        self.dtype = dtype
+
+        # the catalog solution, IAD, and Earth ephemeris only depend on `hip_num`, 
+        # so are cached to disk after the first (slow) load
+        if cache_dir is not None:
+            cache_file = os.path.join(
+                os.path.expanduser(cache_dir), '{}.npz'.format(hip_num)
+            )
+        else:
+            cache_file = None
+
+        if cache_file is None or not self._read_cache(cache_file):
+            self._load_catalog()
+            self._load_iad()
+
+            if cache_file is not None:
+                self._write_cache(cache_file)
+
+        self._precompute_geometry()
+
+    @classmethod
+    def from_arrays(
+        cls, plx0, pm_ra0, pm_dec0, alpha0, delta0, X, Y, Z, cos_phi, sin_phi, R, 
+        eps, epochs, plx0_err=None, pm_ra0_err=None, pm_dec0_err=None, 
+        alpha0_err=None, delta0_err=None, hip_num=None, use_numba=True, 
+        dtype=np.float64
+    ):
+        """
+        Alternate constructor from in-memory arrays, which skips the Vizier query, 
+        IAD file, and ephemeris computation entirely. Useful for tests, 
+        benchmarks, and simulated IAD.
+
+        Args:
+            plx0, pm_ra0, pm_dec0 (float): van Leeuwen catalog parallax [mas] 
+                and proper motions [mas/yr]
+            alpha0, delta0 (float): van Leeuwen catalog position [deg]
+            X, Y, Z (np.array of float): barycentric Earth position at each 
+                IAD epoch [au]
+            cos_phi, sin_phi (np.array of float): scan direction at each epoch
+            R (np.array of float): abscissa residuals [mas]
+            eps (np.array of float): errors on abscissa residuals [mas]
+            epochs (np.array of float): IAD epochs [decimal year]
+            plx0_err, pm_ra0_err, pm_dec0_err, alpha0_err, delta0_err (float, 
+                optional): catalog uncertainties, stored for reference only. 
+                Default: None.
+            hip_num (str, optional): Hipparcos number, stored for reference only.
+                Default: None.
+            use_numba, dtype: see `HipparcosLogProb`
+
+        Returns:
+            HipparcosLogProb
+        """
+        logprob = cls.__new__(cls)
+
+        logprob.hip_num = hip_num
+        logprob.use_numba = use_numba and numba_installed
+        logprob.dtype = dtype
+
+        logprob.plx0 = plx0
+        logprob.pm_ra0 = pm_ra0
+        logprob.pm_dec0 = pm_dec0
+        logprob.alpha0 = alpha0
+        logprob.delta0 = delta0
+        logprob.plx0_err = plx0_err
+        logprob.pm_ra0_err = pm_ra0_err
+        logprob.pm_dec0_err = pm_dec0_err
+        logprob.alpha0_err = alpha0_err
+        logprob.delta0_err = delta0_err
+
+        logprob.epochs = np.asarray(epochs, dtype=np.float64)
+        logprob.epochs_mjd = Time(logprob.epochs, format='decimalyear').mjd
+        logprob.cos_phi = np.asarray(cos_phi, dtype=np.float64)
+        logprob.sin_phi = np.asarray(sin_phi, dtype=np.float64)
+        logprob.R = np.asarray(R, dtype=np.float64)
+        logprob.eps = np.asarray(eps, dtype=np.float64)
+        logprob.X = np.asarray(X, dtype=np.float64)
+        logprob.Y = np.asarray(Y, dtype=np.float64)
+        logprob.Z = np.asarray(Z, dtype=np.float64)
+
+        logprob._precompute_geometry()
+
+        return logprob
+
+    def _read_cache(self, cache_file):
+        """
+        Loads the attributes in `_CACHED_ATTRS` from `cache_file`. A missing 
+        file returns False; an unreadable or incomplete one also raises a 
+        warning, so that the caller reloads the data and rewrites the cache.
+
+        Returns:
+            bool: True if all cached attributes were loaded.
+        """
+        if not os.path.exists(cache_file):
+            return False
+
+        try:
+            with np.load(cache_file) as cached:
+                values = {attr: cached[attr][()] for attr in _CACHED_ATTRS}
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile) as err:
+            warnings.warn('Ignoring unreadable cache file {}: {}'.format(cache_file, err))
+            return False
+
+        for attr, value in values.items():
+            setattr(self, attr, value)
+
+        return True
+
+    def _write_cache(self, cache_file):
+        """
+        Saves the attributes in `_CACHED_ATTRS` to `cache_file`. The file is 
+        written under a temporary name and then renamed into place, so that 
+        concurrent instantiations never read a partial file. Caching is best-effort:
+        failures (e.g. an unwritable cache directory) only raise a warning.
+        """
+        cache_dir = os.path.dirname(cache_file)
+        tmp_file = None
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, tmp_file = tempfile.mkstemp(dir=cache_dir, suffix='.npz.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(
+                    f, **{attr: getattr(self, attr) for attr in _CACHED_ATTRS}
+                )
+            os.replace(tmp_file, cache_file)
 
-        # load best-fit astrometric solution from van Leeuwen catalog
+        except OSError as err:
+            warnings.warn('Could not write cache file {}: {}'.format(cache_file, err))
+            if tmp_file is not None and os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    def _load_catalog(self):
+        """
+        Queries Vizier for the van Leeuwen (2007) astrometric solution of 
+        `self.hip_num`.
+        """
         Vizier.ROW_LIMIT = -1
         hip_cat = Vizier(
             catalog='I/311/hip2', 
@@ -52,9 +506,15 @@ class HipparcosLogProb(object):
         self.alpha0_err = hip_cat['e_RArad'][0] # [mas]
         self.delta0_err = hip_cat['e_DErad'][0] # [mas]
 
-        # read in IAD
-        file_name = '/data/user/sblunt/HipIAD/H{}/HIP{}.d'.format(hip_num[0:3], hip_num)
-        iad = np.transpose(np.loadtxt(file_name, skiprows=1))
+    def _load_iad(self):
+        """
+        Reads in the IAD of `self.hip_num` and computes the barycentric Earth 
+        position at each IAD epoch.
+        """
+        file_name = '/data/user/sblunt/HipIAD/H{}/HIP{}.d'.format(
+            self.hip_num[0:3], self.hip_num
+        )
+        iad = _read_iad(file_name)
 
         times = iad[1] + 1991.25
         epochs = Time(times, format='decimalyear')
@@ -71,26 +531,50 @@ class HipparcosLogProb(object):
         self.Y = bary_pos.y.value # [au]
         self.Z = bary_pos.z.value # [au]
 
-        # reconstruct ephemeris of star given van Leeuwen best-fit (Nielsen+ 2020 Eqs 1-2) [mas]
-        changein_alpha_st = (
-            self.plx0 * (
-                self.X * np.sin(np.radians(self.alpha0)) - 
-                self.Y * np.cos(np.radians(self.alpha0))
-            ) + (self.epochs - 1991.25) * self.pm_ra0
+    def _precompute_geometry(self):
+        """
+        Computes the per-epoch quantities reused by every `compute_lnprob` call
+        from the catalog solution and IAD.
+        """
+        self.inv_eps2 = 1.0 / self.eps**2 # chi2 weights [mas^-2]
+
+        # trig of the catalog position & per-epoch parallax factors [au] and time 
+        # baselines [yr]. These depend only on the van Leeuwen solution, so are 
+        # computed once here and reused by `compute_lnprob`.
+        self._sa = np.sin(np.radians(self.alpha0))
+        self._ca = np.cos(np.radians(self.alpha0))
+        self._sd = np.sin(np.radians(self.delta0))
+        self._cd = np.cos(np.radians(self.delta0))
+        self._A = self.X * self._sa - self.Y * self._ca
+        self._B = (
+            self.X * self._ca * self._sd + self.Y * self._sa * self._sd - 
+            self.Z * self._cd
         )
+        self._dt = self.epochs - 1991.25
 
-        changein_delta = (
-            self.plx0 * (
-                self.X * np.cos(np.radians(self.alpha0)) * np.sin(np.radians(self.delta0)) + 
-                self.Y * np.sin(np.radians(self.alpha0)) * np.sin(np.radians(self.delta0)) - 
-                self.Z * np.cos(np.radians(self.delta0))
-            ) + (self.epochs - 1991.25) * self.pm_dec0
+        # reconstruct ephemeris of star given van Leeuwen best-fit (Nielsen+ 2020 Eqs 1-2) [mas]
+        changein_alpha_st, changein_delta = _parallactic_offsets(
+            self.plx0, self.pm_ra0, self.pm_dec0, self._A, self._B, self._dt
         )
 
         # compute abcissa point (Nielsen+ Eq 3)
         self.alpha_abs_st = self.R * self.cos_phi + changein_alpha_st
         self.delta_abs = self.R * self.sin_phi + changein_delta
 
+        # per-epoch arrays are broadcast along the sample axis in `compute_lnprob`,
+        # so keep them as contiguous 1-D vectors. The chi2 weights stay in float64
+        # so that the reduction is carried out in double precision.
+        for attr in [
+            'cos_phi', 'sin_phi', 'alpha_abs_st', 'delta_abs', '_A', '_B', '_dt'
+        ]:
+            setattr(
+                self, attr, np.ascontiguousarray(getattr(self, attr), dtype=self.dtype)
+            )
+        for attr in ['eps', 'inv_eps2']:
+            setattr(
+                self, attr, np.ascontiguousarray(getattr(self, attr), dtype=np.float64)
+            )
+
     def compute_lnprob(self, samples, negative=False):
         """
         Computes the log probability of an orbit model with respect to the Hipparcos 
@@ -120,14 +604,26 @@ class HipparcosLogProb(object):
                         of the orbital period. tau = (TP_MJD - 58849) / (P_days)
                     mtot [M_sun]: total mass
                     m_pl [M_sun]: secondary mass
+                Each row is used as a contiguous per-parameter vector, so `samples`
+                should be C-ordered (as built by np.array or np.empty). Other 
+                layouts (e.g. the transpose of an (MxN) array) are copied once 
+                on entry. A single orbit may also be passed as a length-N array.
             negative (Bool, optional): if True, return negative log probability.
                 Useful for least-squares minimization. Default: False.
 
         Returns:
             np.array of length M, where M is the number of input orbits (same as def'n
                 in description of `samples` arg above) representing the log probaility
-                for each orbit with respect to the Hipparcos IAD
+                for each orbit with respect to the Hipparcos IAD. A float if 
+                `samples` was a single (1-D) orbit.
         """
+        samples = np.ascontiguousarray(samples)
+        if samples.ndim == 1:
+            lnprob = self.compute_lnprob(samples[:, None], negative=negative)
+            if lnprob is None:
+                return
+            return float(lnprob[0])
+
         n_params = len(samples)
 
         # variables for each of the astrometric fitting parameters
@@ -154,62 +650,222 @@ class HipparcosLogProb(object):
             print('Incorrect number of fitting params in `samples`.')
             return
 
+        # add a prior forcing plx to be positive. Orbits failing it are assigned
+        # -inf up front, and only the remainder are compared against the IAD 
+        # (a NaN plx is not rejected here, and so gives a NaN lnprob).
+        bad_plx = plx <= 0
+        if bad_plx.any():
+            lnprob = np.full(len(plx), -np.inf)
+            if not bad_plx.all():
+                lnprob[~bad_plx] = self.compute_lnprob(samples[:, ~bad_plx])
+
+            if negative:
+                lnprob *= -1
+
+            return lnprob
+
         n_samples = len(pm_ra)
         n_epochs = len(self.epochs)
-        dist = np.empty((n_epochs, n_samples))
 
-        # add parallactic ellipse & proper motion to position (Nielsen+ 2020 Eq 8)
-        for i in np.arange(n_epochs):
+        # if we're including a secondary orbit, compute its perturbation
+        if n_planets == 1:
 
-            # this is the expected offset from the Hipparcos photocenter in 1991.25
-            alpha_C_st = alpha_H0 + plx * (
-                self.X[i] * np.sin(np.radians(self.alpha0)) - 
-                self.Y[i] * np.cos(np.radians(self.alpha0))
-            ) + (self.epochs[i] - 1991.25) * pm_ra
-            delta_C = delta_H0 + plx * (
-                self.X[i] * np.cos(np.radians(self.alpha0)) * np.sin(np.radians(self.delta0)) + 
-                self.Y[i] * np.sin(np.radians(self.alpha0)) * np.sin(np.radians(self.delta0)) -
-                self.Z[i] * np.cos(np.radians(self.delta0))
-            ) + (self.epochs[i] - 1991.25) * pm_dec
-
-            # if we're including a secondary orbit, compute and add its perturbation
+            # compute x_pl - x_st for the whole (n_epochs x n_samples) grid at once
+            raoff, decoff = _calc_orbit_radec(
+                self.epochs_mjd, sma, ecc, inc, aop, pan, tau, plx, mtot
+            )
+
+            # transform to x_st relative to barycenter location (broadcast over epochs)
+            star_frac = -m1 / mtot
+            raoff *= star_frac
+            decoff *= star_frac
+
+        else:
+            raoff = decoff = np.empty((0, 0))
+
+        # cast the per-sample model inputs for the sweep. The orbit offsets are 
+        # left as is, since converting them would cost a full extra pass.
+        pm_ra, pm_dec, alpha_H0, delta_H0, plx = [
+            x.astype(self.dtype, copy=False) 
+            for x in [pm_ra, pm_dec, alpha_H0, delta_H0, plx]
+        ]
+
+        if self.use_numba:
+            chi2 = _chi2_kernel(
+                pm_ra, pm_dec, alpha_H0, delta_H0, plx, raoff, decoff, 
+                self._A, self._B, self._dt, self.alpha_abs_st, self.delta_abs, 
+                self.cos_phi, self.sin_phi, self.inv_eps2
+            )
+
+        elif numexpr_installed:
+
+            # same model & residual as the NumPy branch below (Nielsen+ 2020 Eqs 6 & 8),
+            # fused into a single multithreaded pass without the alpha_C_st/delta_C 
+            # temporaries
             if n_planets == 1:
+                alpha_C_st = 'alpha_H0 + plx * A + dt * pm_ra + raoff'
+                delta_C = 'delta_H0 + plx * B + dt * pm_dec + decoff'
+            else:
+                alpha_C_st = 'alpha_H0 + plx * A + dt * pm_ra'
+                delta_C = 'delta_H0 + plx * B + dt * pm_dec'
+
+            dist = ne.evaluate(
+                '(alpha_abs_st - ({})) * cos_phi + (delta_abs - ({})) * sin_phi'.format(
+                    alpha_C_st, delta_C
+                ), 
+                local_dict={
+                    'alpha_H0': alpha_H0[None, :], 'delta_H0': delta_H0[None, :], 
+                    'plx': plx[None, :], 'pm_ra': pm_ra[None, :], 
+                    'pm_dec': pm_dec[None, :], 'raoff': raoff, 'decoff': decoff, 
+                    'A': self._A[:, None], 'B': self._B[:, None], 'dt': self._dt[:, None], 
+                    'alpha_abs_st': self.alpha_abs_st[:, None], 
+                    'delta_abs': self.delta_abs[:, None], 
+                    'cos_phi': self.cos_phi[:, None], 'sin_phi': self.sin_phi[:, None]
+                }
+            )
 
-                # compute x_pl - x_st
-                raoff, decoff, _ = calc_orbit(
-                    self.epochs_mjd[i], sma, ecc, inc, aop, pan, tau, 
-                    plx, mtot
-                )
+            # compute chi2 (Nielsen+ 2020 Eq 7)
+            chi2 = np.einsum('ij,ij,i->j', dist, dist, self.inv_eps2)
 
-                # transform to x_st relative to barycenter location
-                raoff *= -m1 / mtot
-                decoff *= -m1 / mtot
+        else:
+
+            # add parallactic ellipse & proper motion to position (Nielsen+ 2020 Eq 8).
+            # Arrays below have shape (n_epochs, n_samples), C-ordered so that each 
+            # epoch's samples are contiguous.
+
+            # this is the expected offset from the Hipparcos photocenter in 1991.25
+            alpha_C_st, delta_C = _parallactic_offsets(
+                plx[None, :], pm_ra[None, :], pm_dec[None, :], 
+                self._A[:, None], self._B[:, None], self._dt[:, None]
+            )
+            alpha_C_st += alpha_H0[None, :]
+            delta_C += delta_H0[None, :]
 
+            if n_planets == 1:
                 alpha_C_st += raoff
                 delta_C += decoff
 
-            # calculate distance between line and expected measurement (Nielsen+ 2020 Eq 6) [mas]
-            dist[i, :] = np.abs(
-                (self.alpha_abs_st[i] - alpha_C_st) * self.cos_phi[i] + 
-                (self.delta_abs[i] - delta_C) * self.sin_phi[i]
-            )
+            # calculate distance between line and expected measurement (Nielsen+ 2020 Eq 6) [mas].
+            # Only its square enters chi2, so the sign is left as is.
+            dist = np.empty((n_epochs, n_samples), dtype=self.dtype, order='C')
+            np.subtract(self.alpha_abs_st[:, None], alpha_C_st, out=dist)
+            dist *= self.cos_phi[:, None]
+            dist += (self.delta_abs[:, None] - delta_C) * self.sin_phi[:, None]
 
-        # compute chi2 (Nielsen+ 2020 Eq 7)
-        chi2 = np.sum([(dist[:,i] / self.eps)**2 for i in np.arange(n_samples)], axis=1)
-        lnprob = -0.5 * chi2
+            # compute chi2 (Nielsen+ 2020 Eq 7)
+            chi2 = np.einsum('ij,ij,i->j', dist, dist, self.inv_eps2)
 
-        # add a prior forcing plx to be positive
-        bad_plx = np.where(plx <= 0)[0]
-        lnprob[bad_plx] = -np.inf
+        lnprob = -0.5 * chi2
 
         if negative:
             lnprob *= -1
 
         return lnprob
 
+    def compute_lnprob_batched(self, samples, negative=False, chunk_size=4096, n_jobs=1):
+        """
+        Same as `compute_lnprob`, but evaluates the orbits in chunks of 
+        `chunk_size` samples, so that the (n_epochs x chunk_size) intermediate
+        arrays are bounded by `chunk_size` rather than growing with the total 
+        number of orbits (each is ~3.5 MB for 111 epochs at the default, so 
+        the working set stays at a few tens of MB). Useful for very large 
+        (>~10^6) sample counts.
+
+        Args:
+            samples (np.array of float): see `compute_lnprob`
+            negative (Bool, optional): if True, return negative log probability.
+                Default: False.
+            chunk_size (int, optional): maximum number of orbits evaluated at 
+                once. Default: 4096.
+            n_jobs (int, optional): number of worker processes the chunks are 
+                distributed over. Workers are forked, so this object and 
+                `samples` are shared copy-on-write rather than pickled (not 
+                available on Windows). Forking after numba has started its 
+                threads deadlocks, so the chunks are run serially (with a 
+                warning) if `use_numba` is set or numba's threading layer is 
+                already running; the numba kernel is multithreaded anyway. 
+                Default: 1.
+
+        Returns:
+            np.array of length M (or float): see `compute_lnprob`
+        """
+        samples = np.ascontiguousarray(samples)
+        if samples.ndim == 1:
+            return self.compute_lnprob(samples, negative=negative)
+
+        if len(samples) not in (5, 13):
+            print('Incorrect number of fitting params in `samples`.')
+            return
+
+        n_samples = samples.shape[1]
+
+        if n_jobs > 1:
+            chunk_size = min(chunk_size, -(-n_samples // n_jobs))
+        chunks = [
+            (start, min(start + chunk_size, n_samples)) 
+            for start in range(0, n_samples, chunk_size)
+        ]
+
+        if n_jobs > 1 and (self.use_numba or _numba_threads_launched()):
+            warnings.warn(
+                'numba threads cannot be forked safely; computing chunks serially.'
+            )
+            n_jobs = 1
+
+        lnprob = np.empty(n_samples)
+        if n_jobs > 1 and len(chunks) > 1:
+            global _pool_logprob, _pool_samples
+            _pool_logprob, _pool_samples = self, samples
+            try:
+                with mp.get_context('fork').Pool(n_jobs) as pool:
+                    results = pool.map(partial(_pool_lnprob, negative=negative), chunks)
+            finally:
+                _pool_logprob = _pool_samples = None
+
+            for (start, stop), lnprob_chunk in zip(chunks, results):
+                lnprob[start:stop] = lnprob_chunk
+
+        else:
+            for start, stop in chunks:
+                lnprob[start:stop] = self.compute_lnprob(
+                    samples[:, start:stop], negative=negative
+                )
+
+        return lnprob
+
+
+def _numba_threads_launched():
+    """
+    Returns True if numba's parallel threading layer has been started in this 
+    process, after which it is no longer safe to fork.
+    """
+    if not numba_installed:
+        return False
+
+    try:
+        numba.threading_layer()
+    except ValueError:
+        return False
+
+    return True
+
+
+def _pool_lnprob(chunk, negative=False):
+    """
+    Worker for `HipparcosLogProb.compute_lnprob_batched`. Evaluates the orbits 
+    in columns [start, stop) of the samples inherited from the parent process.
+    """
+    start, stop = chunk
+    return _pool_logprob.compute_lnprob(
+        _pool_samples[:, start:stop], negative=negative
+    )
+
 
 if __name__ == '__main__':
 
+    from orbitize.radvel_utils.compute_sep import compute_sep
+    import matplotlib.pyplot as plt
+
     # instantiate an object for HR 5183
     PlanetPi = HipparcosLogProb(hip_num='027321')
 
@@ -232,20 +888,27 @@ if __name__ == '__main__':
 
     n_samples = len(df_orb['mp'].values)
 
-    # create an orbit model for which to calculate chi2
-    pm_ra_samples = np.random.normal(PlanetPi.pm_ra0, PlanetPi.pm_ra0_err, size=n_samples)
-    pm_dec_samples = np.random.normal(PlanetPi.pm_dec0, PlanetPi.pm_dec0_err, size=n_samples)
-    alpha_H0_samples = np.random.normal(0, 0.1, size=n_samples)
-    dec_H0_samples = np.random.normal(0, 0.1, size=n_samples)
-    mtot_samples = df_orb['m_st'].values + df_orb['mp'].values
-
-    samples = np.array([
-        pm_ra_samples, pm_dec_samples, alpha_H0_samples, dec_H0_samples, 
-        df_orb['plx'].values, df_orb['sma'].values, df_orb['ecc'].values,
-        df_orb['inc_rad'].values, df_orb['omega_pl_rad'].values, 
-        df_orb['lan_rad'].values, df_orb['tau_58849'].values, 
-        mtot_samples, df_orb['mp'].values
-    ])
+    # create an orbit model for which to calculate chi2, filling each row of a
+    # preallocated (n_params x n_samples) array in place
+    rng = np.random.default_rng()
+    samples = np.empty((13, n_samples))
+
+    # astrometric params: Gaussians about the catalog solution
+    for row, (mean, std) in enumerate([
+        (PlanetPi.pm_ra0, PlanetPi.pm_ra0_err), (PlanetPi.pm_dec0, PlanetPi.pm_dec0_err), 
+        (0, 0.1), (0, 0.1)
+    ]):
+        rng.standard_normal(out=samples[row])
+        samples[row] *= std
+        samples[row] += mean
+
+    # orbital params: legacy posterior
+    for row, col in enumerate([
+        'plx', 'sma', 'ecc', 'inc_rad', 'omega_pl_rad', 'lan_rad', 'tau_58849'
+    ], start=4):
+        np.copyto(samples[row], df_orb[col].values)
+    np.add(df_orb['m_st'].values, df_orb['mp'].values, out=samples[11]) # mtot
+    np.copyto(samples[12], df_orb['mp'].values)
 
     # compute chi2
     print('Computing lnprobs!')
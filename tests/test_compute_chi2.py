@@ -0,0 +1,168 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import compute_chi2
+from compute_chi2 import HipparcosLogProb
+
+
+def _synthetic_iad(n_epochs=111, seed=1):
+    """
+    Catalog solution & IAD columns in the form taken by 
+    `HipparcosLogProb.from_arrays`.
+    """
+    rng = np.random.default_rng(seed)
+    epochs = np.sort(rng.uniform(1990.05, 1992.75, n_epochs))
+    earth_phase = 2 * np.pi * (epochs - 1990.)
+    scan_angle = rng.uniform(0, 2 * np.pi, n_epochs)
+
+    return dict(
+        plx0=31.7, pm_ra0=-40., pm_dec0=12., alpha0=223.4, delta0=-21.3, 
+        X=np.cos(earth_phase), Y=0.92 * np.sin(earth_phase), 
+        Z=0.4 * np.sin(earth_phase), cos_phi=np.cos(scan_angle), 
+        sin_phi=np.sin(scan_angle), R=rng.normal(0, 1, n_epochs), 
+        eps=rng.uniform(0.5, 2, n_epochs), epochs=epochs
+    )
+
+# builds a HipparcosLogProb from synthetic IAD, evaluates it once in the parent
+# (starting numba's threads when use_numba=True), then in batched parallel mode
+SCRIPT = """
+import numpy as np
+from compute_chi2 import HipparcosLogProb
+
+rng = np.random.default_rng(1)
+n_epochs, n_samples = 111, 20000
+
+epochs = np.sort(rng.uniform(1990.05, 1992.75, n_epochs))
+earth_phase = 2 * np.pi * (epochs - 1990.)
+scan_angle = rng.uniform(0, 2 * np.pi, n_epochs)
+logprob = HipparcosLogProb.from_arrays(
+    plx0=31.7, pm_ra0=-40., pm_dec0=12., alpha0=223.4, delta0=-21.3, 
+    X=np.cos(earth_phase), Y=0.92 * np.sin(earth_phase), Z=0.4 * np.sin(earth_phase), 
+    cos_phi=np.cos(scan_angle), sin_phi=np.sin(scan_angle), 
+    R=rng.normal(0, 1, n_epochs), eps=rng.uniform(0.5, 2, n_epochs), epochs=epochs, 
+    use_numba={use_numba}
+)
+
+samples = np.array([
+    rng.normal(-40, 0.5, n_samples), rng.normal(12, 0.5, n_samples), 
+    rng.normal(0, 0.1, n_samples), rng.normal(0, 0.1, n_samples), 
+    rng.normal(31.7, 0.3, n_samples), rng.uniform(10, 30, n_samples), 
+    rng.uniform(0, 0.9, n_samples), rng.uniform(0, np.pi, n_samples), 
+    rng.uniform(0, 2 * np.pi, n_samples), rng.uniform(0, np.pi, n_samples), 
+    rng.uniform(0, 1, n_samples), rng.uniform(1, 1.2, n_samples), 
+    rng.uniform(0.001, 0.01, n_samples)
+])
+
+serial = logprob.compute_lnprob(samples)
+parallel = logprob.compute_lnprob_batched(samples, n_jobs=2)
+assert np.array_equal(serial, parallel)
+"""
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='requires fork')
+@pytest.mark.parametrize('use_numba', [True, False])
+def test_batched_parallel_matches_serial(use_numba):
+    """
+    `compute_lnprob_batched(n_jobs>1)` must neither deadlock (forking with numba
+    threads running) nor hang at exit, and must agree with `compute_lnprob`.
+    Run in a subprocess so that a hang fails the test instead of the suite.
+    """
+    result = subprocess.run(
+        [sys.executable, '-c', SCRIPT.format(use_numba=use_numba)], 
+        cwd=REPO_DIR, capture_output=True, text=True, timeout=300
+    )
+    assert result.returncode == 0, result.stderr
+
+
+def test_read_iad_matches_loadtxt(tmp_path):
+    """
+    `_read_iad` must parse the '#'-commented IAD files exactly as the 
+    `np.loadtxt(..., skiprows=1)` call it replaced.
+    """
+    rng = np.random.default_rng(2)
+    data = np.column_stack([
+        np.arange(1, 21), rng.uniform(-1.2, 1.5, 20), rng.integers(0, 2, 20), 
+        rng.uniform(-1, 1, (20, 4))
+    ])
+    file_name = tmp_path / 'HIP000001.d'
+    with open(file_name, 'w') as f:
+        f.write('# This file contains residual records, extracted from the Hipparcos 2\n')
+        f.write('# IORB  EPOCH   PARF    CPSI    SPSI   RES   SRES\n')
+        np.savetxt(f, data, fmt='%.6f')
+
+    np.testing.assert_array_equal(
+        compute_chi2._read_iad(file_name), np.loadtxt(file_name, skiprows=1).T
+    )
+
+
+def test_unreadable_cache_is_reloaded_and_rewritten(tmp_path, monkeypatch):
+    """
+    A corrupt cache file should only warn, with the data reloaded and the 
+    cache rewritten.
+    """
+    iad = _synthetic_iad()
+
+    def fake_load_catalog(self):
+        for attr in ['plx0', 'pm_ra0', 'pm_dec0', 'alpha0', 'delta0']:
+            setattr(self, attr, iad[attr])
+        for attr in ['plx0_err', 'pm_ra0_err', 'pm_dec0_err', 'alpha0_err', 'delta0_err']:
+            setattr(self, attr, 0.5)
+
+    def fake_load_iad(self):
+        for attr in ['X', 'Y', 'Z', 'cos_phi', 'sin_phi', 'R', 'eps', 'epochs']:
+            setattr(self, attr, iad[attr])
+        self.epochs_mjd = (iad['epochs'] - 2000.) * 365.25 + 51544.5
+
+    monkeypatch.setattr(HipparcosLogProb, '_load_catalog', fake_load_catalog)
+    monkeypatch.setattr(HipparcosLogProb, '_load_iad', fake_load_iad)
+
+    cache_file = tmp_path / '000001.npz'
+    cache_file.write_bytes(b'PK\x03\x04 truncated')
+
+    with pytest.warns(UserWarning, match='unreadable cache'):
+        logprob = HipparcosLogProb('000001', cache_dir=str(tmp_path))
+    assert logprob.plx0 == iad['plx0']
+
+    # the rewritten cache loads without touching the catalog or IAD
+    monkeypatch.setattr(HipparcosLogProb, '_load_catalog', None)
+    monkeypatch.setattr(HipparcosLogProb, '_load_iad', None)
+    cached = HipparcosLogProb('000001', cache_dir=str(tmp_path))
+    np.testing.assert_array_equal(cached.alpha_abs_st, logprob.alpha_abs_st)
+
+
+@pytest.mark.parametrize('ecc, rtol', [(0., 5e-4), (0.5, 5e-4), (0.89, 5e-4), (0.95, 1e-8)])
+def test_calc_orbit_radec_matches_orbitize(ecc, rtol):
+    """
+    RA/Dec offsets from the tabulated (e <= 0.9) or directly solved (e > 0.9)
+    eccentric anomalies should match `orbitize.kepler.calc_orbit`, relative to 
+    each orbit's amplitude.
+    """
+    from orbitize.kepler import calc_orbit
+
+    rng = np.random.default_rng(3)
+    n_samples = 2000
+    epochs = np.linspace(47800, 49000, 100)
+    sma = rng.uniform(1, 30, n_samples)
+    ecc = np.full(n_samples, ecc)
+    inc = rng.uniform(0, np.pi, n_samples)
+    aop = rng.uniform(0, 2 * np.pi, n_samples)
+    pan = rng.uniform(0, np.pi, n_samples)
+    tau = rng.uniform(0, 1, n_samples)
+    plx = rng.normal(31.7, 0.3, n_samples)
+    mtot = rng.uniform(1, 1.2, n_samples)
+
+    raoff, decoff, _ = calc_orbit(epochs, sma, ecc, inc, aop, pan, tau, plx, mtot)
+    raoff_tab, decoff_tab = compute_chi2._calc_orbit_radec(
+        epochs, sma, ecc, inc, aop, pan, tau, plx, mtot
+    )
+
+    amplitude = np.max(np.hypot(raoff, decoff), axis=0)
+    error = np.hypot(raoff_tab - raoff, decoff_tab - decoff) / amplitude
+    assert np.max(error) < rtol